@@ -0,0 +1,341 @@
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+import pandas as pd
+
+from src.predict_batch import load_models, predict_frame
+
+SHARD_ROWS = 10000
+HEARTBEAT_S = 15  # il worker aggiorna il mtime del lock mentre elabora lo shard
+LOCK_TTL_S = 120  # lock senza heartbeat da così tanto = worker morto/prelazionato
+
+
+def _shard_paths(job_dir: str, idx: int) -> dict:
+    base = os.path.join(job_dir, "shards", f"shard_{idx:05d}")
+    return {"out": base + ".csv", "done": base + ".done", "lock": base + ".lock"}
+
+
+def _input_signature(in_csv: str) -> dict:
+    st = os.stat(in_csv)
+    return {"size": st.st_size, "mtime": st.st_mtime}
+
+
+def _write_atomic(path: str, write_fn):
+    tmp = f"{path}.tmp.{os.getpid()}"
+    write_fn(tmp)
+    os.replace(tmp, path)
+
+
+def record_offsets(in_csv: str, every: int):
+    """
+    Una sola passata sul file in binario: byte di fine header, numero di righe
+    dati e offset di inizio di una riga ogni `every`. Un record termina a un
+    a-capo solo se le virgolette viste finora sono in numero pari (campi
+    quotati con a-capo interni); le righe vuote sono ignorate come fa pandas.
+    """
+    offsets = []
+    n = 0
+    with open(in_csv, "rb") as f:
+        header_end = None
+        quotes = 0
+        start = 0
+        pos = 0
+        for line in iter(f.readline, b""):
+            quotes += line.count(b'"')
+            pos += len(line)
+            if quotes % 2:
+                continue  # a-capo dentro un campo quotato
+            if header_end is None:
+                header_end = pos
+            elif line.strip() or start != pos - len(line):
+                if n % every == 0:
+                    offsets.append(start)
+                n += 1
+            quotes = 0
+            start = pos
+    return (header_end or 0), n, offsets
+
+
+def plan(in_csv: str, job_dir: str, shard_rows: int = SHARD_ROWS, cascade: bool = False) -> dict:
+    """
+    Crea il manifest del job: shard per intervalli di righe [start, stop) con
+    l'offset in byte di inizio/fine, così ogni worker legge solo il suo pezzo.
+    Se il manifest esiste già viene riusato, purché input e opzioni coincidano.
+    """
+    manifest_path = os.path.join(job_dir, "manifest.json")
+    if os.path.exists(manifest_path):
+        manifest = load_manifest(job_dir)
+        requested = {"in_csv": os.path.abspath(in_csv), "input": _input_signature(in_csv),
+                     "shard_rows": shard_rows, "cascade": cascade}
+        diff = [k for k, v in requested.items() if manifest.get(k) != v]
+        if diff:
+            raise ValueError(
+                f"Manifest già presente in {job_dir} con {', '.join(diff)} diversi: usa un'altra cartella --job"
+            )
+        print(f"Manifest già presente: {manifest_path}")
+        return manifest
+
+    os.makedirs(os.path.join(job_dir, "shards"), exist_ok=True)
+    header_end, n, offsets = record_offsets(in_csv, shard_rows)
+    ends = offsets[1:] + [os.path.getsize(in_csv)]
+    shards = [
+        {"idx": i, "start": i * shard_rows, "stop": min((i + 1) * shard_rows, n),
+         "offset": off, "end": end}
+        for i, (off, end) in enumerate(zip(offsets, ends))
+    ]
+    manifest = {
+        "in_csv": os.path.abspath(in_csv),
+        "input": _input_signature(in_csv),
+        "rows": n,
+        "header_end": header_end,
+        "shard_rows": shard_rows,
+        "cascade": cascade,
+        "shards": shards,
+    }
+    _write_atomic(manifest_path, lambda p: _dump_json(manifest, p))
+    print(f"Creato manifest: {manifest_path} ({n} righe, {len(shards)} shard)")
+    return manifest
+
+
+def _dump_json(obj, path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=2)
+
+
+def load_manifest(job_dir: str) -> dict:
+    with open(os.path.join(job_dir, "manifest.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _read_lock(lock_path: str) -> Optional[str]:
+    try:
+        with open(lock_path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def _owner_dead(token: str) -> bool:
+    """Lock di un processo di questo host che non esiste più (solo POSIX)."""
+    parts = token.split()
+    if os.name != "posix" or len(parts) < 2 or parts[0] != socket.gethostname():
+        return False
+    try:
+        os.kill(int(parts[1]), 0)
+    except ProcessLookupError:
+        return True
+    except (PermissionError, ValueError):
+        return False
+    return False
+
+
+def _lock_stale(lock_path: str, token: str) -> bool:
+    try:
+        age = time.time() - os.path.getmtime(lock_path)
+    except FileNotFoundError:
+        return True
+    return age >= LOCK_TTL_S or _owner_dead(token)
+
+
+def _try_claim(lock_path: str) -> Optional[str]:
+    """
+    Lock-file locale: creazione esclusiva (O_EXCL) con un token univoco.
+    Un lock scaduto (nessun heartbeat) o di un processo morto viene rimosso e
+    ritentato una volta. Dopo la creazione si rilegge il token: se un altro
+    worker ha rimosso e ricreato il lock nel frattempo, si rinuncia.
+    Ritorna il token se lo shard è nostro, altrimenti None.
+    """
+    token = f"{socket.gethostname()} {os.getpid()} {uuid.uuid4().hex}"
+    for _ in range(2):
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            seen = _read_lock(lock_path)
+            if seen is None:
+                continue
+            if not _lock_stale(lock_path, seen):
+                return None
+            # Rimuove solo se è ancora lo stesso lock scaduto osservato
+            if _read_lock(lock_path) == seen:
+                try:
+                    os.remove(lock_path)
+                except FileNotFoundError:
+                    pass
+            continue
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(token + "\n")
+        return token if _read_lock(lock_path) == token else None
+    return None
+
+
+def _heartbeat(lock_path: str, token: str, stop: threading.Event):
+    while not stop.wait(HEARTBEAT_S):
+        if _read_lock(lock_path) != token:
+            return
+        try:
+            os.utime(lock_path)
+        except FileNotFoundError:
+            return
+
+
+def pending_shards(job_dir: str, manifest: dict) -> List[dict]:
+    return [s for s in manifest["shards"] if not os.path.exists(_shard_paths(job_dir, s["idx"])["done"])]
+
+
+def read_shard(manifest: dict, shard: dict) -> pd.DataFrame:
+    """Legge solo header + byte [offset, end) dello shard: nessuna riga precedente viene ri-tokenizzata."""
+    with open(manifest["in_csv"], "rb") as f:
+        header = f.read(manifest["header_end"])
+        f.seek(shard["offset"])
+        body = f.read(shard["end"] - shard["offset"])
+    df = pd.read_csv(io.BytesIO(header + body))
+    if len(df) != shard["stop"] - shard["start"]:
+        raise ValueError(
+            f"Shard {shard['idx']:05d}: attese {shard['stop'] - shard['start']} righe, lette {len(df)}"
+        )
+    return df
+
+
+def run_shard(manifest: dict, shard: dict, job_dir: str, cat_model, pri_model, token: str) -> Optional[int]:
+    df = read_shard(manifest, shard)
+    out, _ = predict_frame(df, cat_model, pri_model, cascade=manifest["cascade"])
+
+    paths = _shard_paths(job_dir, shard["idx"])
+    if _read_lock(paths["lock"]) != token:
+        return None  # lock perso (ripreso da un altro worker): l'output sarà suo
+    # Output idempotente: scrittura su tmp + rename, poi checkpoint .done
+    _write_atomic(paths["out"], lambda p: out.to_csv(p, index=False))
+    _write_atomic(paths["done"], lambda p: _dump_json({"rows": len(out), "finished": time.time()}, p))
+    return len(out)
+
+
+def work(job_dir: str, max_shards: Optional[int] = None) -> int:
+    """
+    Elabora gli shard pendenti, saltando quelli completati o in lavorazione
+    da altri worker. Più worker possono girare in parallelo sullo stesso job.
+    Ritorna il numero di shard elaborati da questo worker.
+    """
+    manifest = load_manifest(job_dir)
+    if _input_signature(manifest["in_csv"]) != manifest["input"]:
+        raise ValueError(f"Il CSV di input è cambiato dopo il plan: {manifest['in_csv']}")
+
+    cat_model, pri_model = load_models(manifest["cascade"])
+
+    done = 0
+    for shard in pending_shards(job_dir, manifest):
+        if max_shards is not None and done >= max_shards:
+            break
+        paths = _shard_paths(job_dir, shard["idx"])
+        token = _try_claim(paths["lock"])
+        if token is None:
+            continue
+        stop = threading.Event()
+        threading.Thread(target=_heartbeat, args=(paths["lock"], token, stop), daemon=True).start()
+        try:
+            # Ricontrollo dopo il claim: un altro worker può averlo appena chiuso
+            if os.path.exists(paths["done"]):
+                continue
+            t0 = time.perf_counter()
+            n = run_shard(manifest, shard, job_dir, cat_model, pri_model, token)
+            if n is None:
+                print(f"Shard {shard['idx']:05d}: lock perso, lasciato all'altro worker")
+                continue
+            done += 1
+            print(f"Shard {shard['idx']:05d}: {n} righe in {time.perf_counter() - t0:.1f}s")
+        finally:
+            stop.set()
+            if _read_lock(paths["lock"]) == token:
+                try:
+                    os.remove(paths["lock"])
+                except FileNotFoundError:
+                    pass
+
+    left = len(pending_shards(job_dir, manifest))
+    print(f"Worker terminato: {done} shard elaborati, {left} ancora pendenti")
+    return done
+
+
+def merge(job_dir: str, out_csv: str = "data/predictions.csv") -> int:
+    """Unisce gli output degli shard, in ordine, in un unico CSV."""
+    manifest = load_manifest(job_dir)
+    missing = pending_shards(job_dir, manifest)
+    if missing:
+        raise ValueError(f"Merge impossibile: {len(missing)} shard non completati (es. {missing[0]['idx']:05d})")
+
+    if not manifest["shards"]:
+        # Input senza righe: stesso header (solo colonne) che scriverebbe predict_batch
+        with open(manifest["in_csv"], "rb") as f:
+            empty = pd.read_csv(io.BytesIO(f.read(manifest["header_end"])))
+        cat_model, pri_model = load_models(manifest["cascade"])
+        out, _ = predict_frame(empty, cat_model, pri_model, cascade=manifest["cascade"])
+        _write_atomic(out_csv, lambda p: out.to_csv(p, index=False))
+        print(f"Creato: {out_csv} (0 righe, input senza ticket)")
+        return 0
+
+    def write_merged(tmp: str):
+        # Copia testuale (senza ri-parsing): header solo dal primo shard
+        with open(tmp, "wb") as out:
+            for i, shard in enumerate(manifest["shards"]):
+                with open(_shard_paths(job_dir, shard["idx"])["out"], "rb") as part:
+                    header = part.readline()
+                    if i == 0:
+                        out.write(header)
+                    shutil.copyfileobj(part, out)
+
+    _write_atomic(out_csv, write_merged)
+    print(f"Creato: {out_csv} ({manifest['rows']} righe da {len(manifest['shards'])} shard)")
+    return manifest["rows"]
+
+
+def main():
+    p = argparse.ArgumentParser(description="Batch job a shard, riprendibili, per predict_batch")
+    sub = p.add_subparsers(dest="cmd", required=True)
+
+    sp = sub.add_parser("plan", help="Crea il manifest degli shard")
+    sp.add_argument("--in", dest="in_csv", type=str, default="data/tickets.csv")
+    sp.add_argument("--job", type=str, required=True, help="Cartella del job (es. data/jobs/backfill)")
+    sp.add_argument("--shard-rows", type=int, default=SHARD_ROWS)
+    sp.add_argument("--cascade", action="store_true")
+
+    sw = sub.add_parser("work", help="Elabora gli shard pendenti")
+    sw.add_argument("--job", type=str, required=True)
+    sw.add_argument("--max-shards", type=int, default=None)
+
+    sm = sub.add_parser("merge", help="Unisce gli shard completati nell'output finale")
+    sm.add_argument("--job", type=str, required=True)
+    sm.add_argument("--out", dest="out_csv", type=str, default="data/predictions.csv")
+
+    sr = sub.add_parser("run", help="plan + work + merge in un solo comando")
+    sr.add_argument("--in", dest="in_csv", type=str, default="data/tickets.csv")
+    sr.add_argument("--job", type=str, required=True)
+    sr.add_argument("--shard-rows", type=int, default=SHARD_ROWS)
+    sr.add_argument("--cascade", action="store_true")
+    sr.add_argument("--out", dest="out_csv", type=str, default="data/predictions.csv")
+
+    args = p.parse_args()
+
+    if args.cmd in ("plan", "run"):
+        plan(args.in_csv, args.job, shard_rows=args.shard_rows, cascade=args.cascade)
+    if args.cmd == "work":
+        work(args.job, max_shards=args.max_shards)
+    if args.cmd == "run":
+        work(args.job)
+        if pending_shards(args.job, load_manifest(args.job)):
+            print("Shard ancora in lavorazione da altri worker: merge rimandato")
+            return
+    if args.cmd in ("merge", "run"):
+        merge(args.job, args.out_csv)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics import f1_score
+from sklearn.model_selection import train_test_split
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.pipeline import Pipeline
+
+# Perdita massima di F1 macro accettata rispetto al modello categoria selezionato
+F1_TOLERANCE = 0.01
+THRESHOLD_GRID = np.round(np.arange(0.50, 1.0001, 0.01), 2)
+FAST_MAX_FEATURES = 1000  # vocabolario dello stadio fast (solo unigrammi)
+TIMING_REPEATS = 20  # ripetizioni per il confronto dei tempi (si usa la mediana)
+
+STAGE_FAST = "fast"
+STAGE_SLOW = "slow"
+
+
+@dataclass
+class CascadeModel:
+    """
+    Cascata a due stadi per la categoria: il modello economico (fast) decide
+    quando la sua confidenza è >= threshold, altrimenti decide il modello slow.
+    Se i due stadi condividono il vectorizer, il testo viene trasformato una volta sola.
+    fast=None: cascata disattivata, decide sempre il modello selezionato (slow).
+    """
+    fast: Optional[object]
+    slow: object
+    threshold: float
+    fast_name: Optional[str]
+    slow_name: str
+    reference_name: str  # modello selezionato rispetto a cui è misurata la tolleranza
+
+
+def build_fast_pipeline() -> Pipeline:
+    """
+    Stadio fast: Naive Bayes con un vectorizer proprio, più piccolo ed economico
+    di quello dei candidati (unigrammi, niente preprocessor, vocabolario ridotto).
+    """
+    return Pipeline([
+        ("tfidf", TfidfVectorizer(max_features=FAST_MAX_FEATURES)),
+        ("clf", MultinomialNB()),
+    ])
+
+
+def _conf(clf, F) -> Tuple[np.ndarray, np.ndarray]:
+    probs = clf.predict_proba(F)
+    return clf.classes_[probs.argmax(axis=1)], probs.max(axis=1)
+
+
+def _median_time(fn, repeats: int = TIMING_REPEATS) -> float:
+    fn()  # warm-up
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times))
+
+
+def tune_threshold(fast_pipe, slow_pipe, X_val, y_val, f1_ref: float,
+                   tolerance: float = F1_TOLERANCE) -> Tuple[float, float]:
+    """
+    Sceglie la soglia più bassa (= più traffico allo stadio fast) che mantiene
+    l'F1 macro della cascata entro `tolerance` da f1_ref (modello selezionato).
+    Ritorna: (soglia, quota_fast_su_validation)
+    """
+    fast_pred, fast_conf = _conf(fast_pipe, X_val)
+    slow_pred = slow_pipe.predict(X_val)
+
+    for t in THRESHOLD_GRID:
+        use_fast = fast_conf >= t
+        combined = np.where(use_fast, fast_pred, slow_pred)
+        if f1_score(y_val, combined, average="macro") >= f1_ref - tolerance:
+            return float(t), float(use_fast.mean())
+
+    # Nessuna soglia rispetta la tolleranza: tutto al modello selezionato (slow)
+    return float("inf"), 0.0
+
+
+def predict_cascade(cascade: CascadeModel, X) -> Tuple[List[str], List[float], List[str], Dict[str, float]]:
+    """
+    Ritorna: (predizioni, confidenze, stadio, statistiche)
+    stadio: 'fast' o 'slow' per ogni ticket.
+    statistiche: quota di traffico per stadio e tempi misurati (secondi).
+    """
+    X = list(X)
+    n = len(X)
+    slow_vec = cascade.slow.named_steps["tfidf"]
+    if n == 0:
+        stats = {"n": 0, "n_fast": 0, "n_slow": 0, "share_fast": 0.0,
+                 "vectorize_s": 0.0, "fast_s": 0.0, "slow_s": 0.0}
+        return [], [], [], stats
+
+    if cascade.fast is None:
+        # Cascata disattivata: tutto al modello selezionato
+        t0 = time.perf_counter()
+        F = slow_vec.transform(X)
+        vectorize_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        pred, conf = _conf(cascade.slow.named_steps["clf"], F)
+        slow_s = time.perf_counter() - t0
+        stats = {"n": n, "n_fast": 0, "n_slow": n, "share_fast": 0.0,
+                 "vectorize_s": vectorize_s, "fast_s": 0.0, "slow_s": slow_s}
+        return pred.tolist(), conf.tolist(), [STAGE_SLOW] * n, stats
+
+    vec = cascade.fast.named_steps["tfidf"]
+    shared = vec is slow_vec
+
+    t0 = time.perf_counter()
+    F = vec.transform(X)
+    vectorize_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    pred, conf = _conf(cascade.fast.named_steps["clf"], F)
+    fast_s = time.perf_counter() - t0
+
+    pred = pred.astype(object)
+    stages = np.full(n, STAGE_FAST, dtype=object)
+    uncertain = np.flatnonzero(conf < cascade.threshold)
+
+    slow_s = 0.0
+    if len(uncertain):
+        # Il tempo slow include la vettorizzazione dei soli ticket incerti (se il vectorizer è diverso)
+        t0 = time.perf_counter()
+        slow_F = F[uncertain] if shared else slow_vec.transform([X[i] for i in uncertain])
+        slow_pred, slow_conf = _conf(cascade.slow.named_steps["clf"], slow_F)
+        slow_s = time.perf_counter() - t0
+        pred[uncertain] = slow_pred
+        conf[uncertain] = slow_conf
+        stages[uncertain] = STAGE_SLOW
+
+    stats = {
+        "n": n,
+        "n_fast": int(n - len(uncertain)),
+        "n_slow": int(len(uncertain)),
+        "share_fast": float((n - len(uncertain)) / n) if n else 0.0,
+        "vectorize_s": vectorize_s,
+        "fast_s": fast_s,
+        "slow_s": slow_s,
+    }
+    return pred.tolist(), conf.tolist(), stages.tolist(), stats
+
+
+def build_cascade(best: dict, X_train, y_train, X_test, y_test, tolerance: float = F1_TOLERANCE) -> dict:
+    """
+    best: modello categoria selezionato (pipeline già addestrata), stadio slow.
+    Stadio fast: build_fast_pipeline(), sempre lo stesso, addestrato su X_train.
+    La soglia si calibra su uno split di validation ricavato da X_train
+    (copie dei modelli riaddestrate sul resto), così il test resta pulito.
+    La cascata viene disattivata (resta solo il modello selezionato) se la soglia
+    manda tutto allo slow o se sul test non è misurabilmente più rapida.
+    """
+    fast_name = "NaiveBayes-small"
+    fast_pipe = build_fast_pipeline().fit(X_train, y_train)
+
+    X_fit, X_val, y_fit, y_val = train_test_split(
+        X_train, y_train, test_size=0.2, random_state=42, stratify=y_train
+    )
+    fast_val = build_fast_pipeline().fit(X_fit, y_fit)
+    slow_val = clone(best["pipe"]).fit(X_fit, y_fit)
+    f1_ref_val = f1_score(y_val, slow_val.predict(X_val), average="macro")
+
+    threshold, val_share_fast = tune_threshold(fast_val, slow_val, X_val, y_val, f1_ref_val, tolerance=tolerance)
+    cascade = CascadeModel(
+        fast=fast_pipe, slow=best["pipe"], threshold=threshold,
+        fast_name=fast_name, slow_name=best["name"], reference_name=best["name"],
+    )
+
+    # Valutazione sul test: qualità e tempo (mediana di più ripetizioni) rispetto al solo modello selezionato
+    X_test = list(X_test)
+    best_pred = best["pipe"].predict(X_test)
+    y_pred, _, _, stats = predict_cascade(cascade, X_test)
+    baseline_s = _median_time(lambda: best["pipe"].predict(X_test))
+    cascade_s = _median_time(lambda: predict_cascade(cascade, X_test))
+
+    f1_best = f1_score(y_test, best_pred, average="macro")
+    f1_cascade = f1_score(y_test, y_pred, average="macro")
+
+    print(f"\n== CATEGORY | Cascata {fast_name} -> {best['name']} ==")
+    print(f"Soglia (validation): {threshold:.2f} | tolleranza F1 vs {best['name']}: {tolerance:.3f}")
+    print(f"F1 macro cascata: {f1_cascade:.3f} (solo {best['name']}: {f1_best:.3f})")
+    print(f"Traffico stadio fast: {stats['share_fast']:.1%} | slow: {1 - stats['share_fast']:.1%}")
+    print(
+        f"Tempo test misurato (mediana di {TIMING_REPEATS}): cascata {cascade_s * 1000:.2f} ms "
+        f"vs solo {best['name']} {baseline_s * 1000:.2f} ms"
+    )
+    if f1_cascade < f1_best - tolerance:
+        print(f">>> Attenzione: sul test la cascata perde più di {tolerance:.3f} di F1 rispetto a {best['name']}")
+
+    disabled = None
+    if val_share_fast == 0.0:
+        disabled = "nessuna soglia rispetta la tolleranza F1 (tutto allo stadio slow)"
+    elif cascade_s >= baseline_s:
+        disabled = f"non più rapida di {best['name']} da solo"
+    if disabled:
+        print(f">>> Cascata disattivata: {disabled}. --cascade usa solo {best['name']}")
+        cascade = CascadeModel(
+            fast=None, slow=best["pipe"], threshold=float("inf"),
+            fast_name=None, slow_name=best["name"], reference_name=best["name"],
+        )
+
+    return {
+        "cascade": cascade,
+        "active": disabled is None,
+        "disabled_reason": disabled,
+        "fast": fast_name,
+        "slow": best["name"],
+        "reference": best["name"],
+        "threshold": threshold,
+        "val_share_fast": val_share_fast,
+        "share_fast": stats["share_fast"],
+        "f1_macro": f1_cascade,
+        "f1_reference": f1_best,
+        "cascade_s": cascade_s,
+        "baseline_s": baseline_s,
+    }
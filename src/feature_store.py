@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+from typing import Callable, Optional, Sequence, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+STORE_ROOT = "data/features"
+
+# Array CSR salvati come binari grezzi: appendibili e memory-mappabili
+ARRAYS = {"indptr": np.int64, "indices": np.int32, "data": np.float64, "row_ids": np.int64}
+
+
+def ticket_texts(df: pd.DataFrame) -> pd.Series:
+    return (df["title"].fillna("") + " " + df["body"].fillna("")).astype(str)
+
+
+def row_positions(df: pd.DataFrame) -> np.ndarray:
+    """Row id posizionali (0..n-1): training e report non dipendono dalla colonna id."""
+    return np.arange(len(df), dtype=np.int64)
+
+
+def ticket_ids(df: pd.DataFrame) -> np.ndarray:
+    """
+    Row id dalla colonna id (interi univoci), per gli store gestiti da CLI
+    (append/similar restituiscono questi id). Senza colonna id: posizioni.
+    """
+    if "id" not in df.columns:
+        return row_positions(df)
+    ids = pd.to_numeric(df["id"], errors="coerce")
+    if ids.isna().any() or (ids != ids.round()).any():
+        raise ValueError("La colonna id deve contenere solo interi per il feature store")
+    ids = ids.to_numpy(dtype=np.int64)
+    _check_unique(ids)
+    return ids
+
+
+def _hash_texts(texts: Sequence[str], row_ids: np.ndarray) -> str:
+    h = hashlib.sha256()
+    h.update(np.asarray(row_ids, dtype=np.int64).tobytes())
+    for t in texts:
+        h.update(t.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def vectorizer_config(vec) -> dict:
+    """Parametri del vectorizer serializzabili (le funzioni per nome qualificato)."""
+    cfg = {}
+    for k, v in sorted(vec.get_params().items()):
+        if callable(v):
+            v = f"{v.__module__}.{v.__qualname__}"
+        elif isinstance(v, type):
+            v = v.__name__
+        cfg[k] = v if isinstance(v, (str, int, float, bool, type(None))) else repr(v)
+    return cfg
+
+
+def store_key(texts: Sequence[str], row_ids: np.ndarray, vec, fit_ids: Optional[np.ndarray] = None) -> str:
+    """
+    Chiave = hash dataset + configurazione vectorizer + righe usate per il fit
+    (il vectorizer si addestra solo sul training, come nella pipeline).
+    """
+    h = hashlib.sha256()
+    h.update(_hash_texts(texts, row_ids).encode())
+    h.update(json.dumps(vectorizer_config(vec), sort_keys=True).encode())
+    if fit_ids is not None:
+        h.update(np.sort(np.asarray(fit_ids, dtype=np.int64)).tobytes())
+    return h.hexdigest()[:16]
+
+
+def _arr_path(path: str, name: str) -> str:
+    return os.path.join(path, f"{name}.bin")
+
+
+def _write_meta(path: str, meta: dict):
+    tmp = os.path.join(path, "meta.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp, os.path.join(path, "meta.json"))
+
+
+def _read_meta(path: str) -> dict:
+    with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _mmap(path: str, name: str, length: int) -> np.ndarray:
+    if length == 0:
+        return np.zeros(0, dtype=ARRAYS[name])
+    return np.memmap(_arr_path(path, name), dtype=ARRAYS[name], mode="r", shape=(length,))
+
+
+def build(texts: Sequence[str], row_ids: np.ndarray, vec, fit_ids: Optional[np.ndarray] = None,
+          root: str = STORE_ROOT) -> str:
+    """
+    Addestra `vec` sulle righe fit_ids (tutte se None), trasforma l'intero
+    dataset e salva la matrice CSR. Ritorna la cartella dello store.
+    """
+    texts = list(texts)
+    row_ids = np.asarray(row_ids, dtype=np.int64)
+    path = os.path.join(root, store_key(texts, row_ids, vec, fit_ids))
+    if os.path.exists(os.path.join(path, "meta.json")):
+        return path  # già costruito: non sovrascrive eventuali righe aggiunte con append
+    os.makedirs(path, exist_ok=True)
+
+    if fit_ids is None:
+        X = vec.fit_transform(texts).tocsr()
+    else:
+        fit_mask = np.isin(row_ids, fit_ids)
+        vec.fit([t for t, m in zip(texts, fit_mask) if m])
+        X = vec.transform(texts).tocsr()
+
+    arrays = {"indptr": X.indptr, "indices": X.indices, "data": X.data, "row_ids": row_ids}
+    for name, arr in arrays.items():
+        np.ascontiguousarray(arr, dtype=ARRAYS[name]).tofile(_arr_path(path, name))
+    joblib.dump(vec, os.path.join(path, "vectorizer.joblib"))
+
+    _write_meta(path, {
+        "n_rows": X.shape[0],
+        "n_features": X.shape[1],
+        "nnz": int(X.nnz),
+        # La chiave identifica solo il dataset di base; gli append sono segmenti successivi
+        "base_rows": X.shape[0],
+        "segments": [],
+        "vectorizer": vectorizer_config(vec),
+    })
+    return path
+
+
+def _check_unique(row_ids: np.ndarray, existing: Optional[np.ndarray] = None):
+    ids = np.asarray(row_ids, dtype=np.int64)
+    if len(np.unique(ids)) != len(ids):
+        raise ValueError("Row id duplicati nei ticket (colonna id)")
+    if existing is not None and np.isin(ids, existing).any():
+        dup = ids[np.isin(ids, existing)][:5].tolist()
+        raise ValueError(f"Row id già presenti nel feature store: {dup}")
+
+
+def load(path: str, include_appended: bool = True) -> Tuple[sparse.csr_matrix, np.ndarray, object]:
+    """
+    Matrice CSR memory-mapped (sola lettura), row id e vectorizer addestrato.
+    include_appended=False restituisce solo le righe del dataset di base
+    (quelle identificate dalla chiave dello store).
+    """
+    meta = _read_meta(path)
+    if include_appended:
+        n, nnz = meta["n_rows"], meta["nnz"]
+    else:
+        n = meta["base_rows"]
+        nnz = int(_mmap(path, "indptr", n + 1)[n])
+    X = sparse.csr_matrix(
+        (_mmap(path, "data", nnz), _mmap(path, "indices", nnz), _mmap(path, "indptr", n + 1)),
+        shape=(n, meta["n_features"]),
+        copy=False,
+    )
+    vec = joblib.load(os.path.join(path, "vectorizer.joblib"))
+    return X, _mmap(path, "row_ids", n), vec
+
+
+def lookup(texts: Sequence[str], row_ids: np.ndarray, make_vectorizer: Callable,
+           fit_ids: Optional[np.ndarray] = None, root: str = STORE_ROOT) -> Optional[str]:
+    """Cartella dello store per questo dataset/configurazione, None se non esiste."""
+    path = os.path.join(root, store_key(list(texts), row_ids, make_vectorizer(), fit_ids))
+    return path if os.path.exists(os.path.join(path, "meta.json")) else None
+
+
+def get_or_build(texts: Sequence[str], row_ids: np.ndarray, make_vectorizer: Callable,
+                 fit_ids: Optional[np.ndarray] = None, root: str = STORE_ROOT):
+    """
+    Come load(), ma costruisce lo store se manca per questo dataset/configurazione.
+    Ritorna: (X, row_ids, vectorizer, cartella dello store)
+    """
+    texts = list(texts)
+    path = lookup(texts, row_ids, make_vectorizer, fit_ids, root=root)
+    if path is None:
+        path = build(texts, row_ids, make_vectorizer(), fit_ids=fit_ids, root=root)
+    return (*load(path, include_appended=False), path)
+
+
+def append(path: str, texts: Sequence[str], row_ids: np.ndarray) -> int:
+    """
+    Aggiunge nuovi ticket in coda allo store come nuovo segmento (vocabolario
+    e IDF restano quelli del fit iniziale). Le righe di base, a cui si riferisce
+    la chiave, non cambiano. Ritorna il numero totale di righe.
+    """
+    meta = _read_meta(path)
+    texts = list(texts)
+    row_ids = np.asarray(row_ids, dtype=np.int64)
+    n, nnz = meta["n_rows"], meta["nnz"]
+    _check_unique(row_ids, existing=_mmap(path, "row_ids", n))
+
+    vec = joblib.load(os.path.join(path, "vectorizer.joblib"))
+    X = vec.transform(texts).tocsr()
+
+    valid = {"indptr": n + 1, "indices": nnz, "data": nnz, "row_ids": n}
+    new_arrays = {"indptr": X.indptr[1:].astype(np.int64) + nnz, "indices": X.indices, "data": X.data,
+                  "row_ids": row_ids}
+    for name, arr in new_arrays.items():
+        with open(_arr_path(path, name), "r+b") as f:
+            # Scarta eventuali code di un append interrotto prima del meta.json
+            f.truncate(valid[name] * np.dtype(ARRAYS[name]).itemsize)
+            f.seek(0, os.SEEK_END)
+            np.ascontiguousarray(arr, dtype=ARRAYS[name]).tofile(f)
+
+    # meta.json aggiornato per ultimo: fa da checkpoint delle lunghezze valide
+    meta["n_rows"] = n + X.shape[0]
+    meta["nnz"] = nnz + int(X.nnz)
+    meta.setdefault("segments", []).append({"rows": X.shape[0], "hash": _hash_texts(texts, row_ids)})
+    _write_meta(path, meta)
+    return meta["n_rows"]
+
+
+def rows(X: sparse.csr_matrix, row_ids: np.ndarray, wanted_ids) -> sparse.csr_matrix:
+    """Sottomatrice nelle posizioni dei row id richiesti (nell'ordine richiesto)."""
+    pos = pd.Index(np.asarray(row_ids)).get_indexer(np.asarray(wanted_ids, dtype=np.int64))
+    if (pos < 0).any():
+        raise KeyError("Alcuni id non sono presenti nel feature store")
+    return X[pos]
+
+
+def similar(path: str, text: str, k: int = 5) -> list:
+    """Ticket più simili (coseno su TF-IDF, righe già normalizzate L2)."""
+    X, row_ids, vec = load(path)
+    q = vec.transform([text])
+    scores = (X @ q.T).toarray().ravel()
+    top = np.argsort(scores)[::-1][:k]
+    return [(int(row_ids[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+
+def main():
+    from src.train_models import build_vectorizer
+
+    p = argparse.ArgumentParser(description="Feature store TF-IDF su disco (CSR memory-mapped)")
+    sub = p.add_subparsers(dest="cmd", required=True)
+
+    sb = sub.add_parser("build", help="Vettorizza un CSV (fit su tutte le righe)")
+    sb.add_argument("--in", dest="in_csv", type=str, default="data/tickets.csv")
+
+    sa = sub.add_parser("append", help="Aggiunge nuovi ticket a uno store esistente")
+    sa.add_argument("--store", type=str, required=True)
+    sa.add_argument("--in", dest="in_csv", type=str, required=True)
+
+    ss = sub.add_parser("similar", help="Ticket più simili a un testo")
+    ss.add_argument("--store", type=str, required=True)
+    ss.add_argument("--text", type=str, required=True)
+    ss.add_argument("--k", type=int, default=5)
+
+    args = p.parse_args()
+
+    if args.cmd == "build":
+        df = pd.read_csv(args.in_csv)
+        vec = build_vectorizer()
+        path = build(ticket_texts(df), ticket_ids(df), vec)
+        meta = _read_meta(path)
+        print(f"Feature store: {path} ({meta['base_rows']} righe di base + "
+              f"{meta['n_rows'] - meta['base_rows']} aggiunte, {meta['n_features']} feature)")
+    elif args.cmd == "append":
+        df = pd.read_csv(args.in_csv)
+        n = append(args.store, ticket_texts(df), ticket_ids(df))
+        print(f"Aggiunte {len(df)} righe: {args.store} ({n} righe totali)")
+    elif args.cmd == "similar":
+        for rid, score in similar(args.store, args.text, k=args.k):
+            print(f"{rid}\t{score:.3f}")
+
+
+if __name__ == "__main__":
+    main()
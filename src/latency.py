@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import io
+import time
+from typing import List, Optional
+
+import joblib
+import numpy as np
+
+LATENCY_SAMPLE = 200  # predizioni singole per round (i ticket del test vengono ripetuti ciclicamente)
+LATENCY_ROUNDS = 5  # round misurati dopo un round di warm-up; si riporta la mediana tra i round
+SELECT_F1_TOLERANCE = 0.005  # in modalità pareto: F1 ceduto in cambio di velocità
+SELECT_MODES = ("f1", "pareto")
+
+
+class BudgetError(ValueError):
+    """Nessun candidato rispetta i budget di latenza/dimensione."""
+
+
+def profile_model(pipe, X_test) -> dict:
+    """
+    Costi di inferenza sul test: latenza singolo ticket (p50/p99, ms),
+    throughput batch (ticket/s), dimensione serializzata (KB) e tempo di load (ms).
+    Latenze e throughput sono la mediana su LATENCY_ROUNDS round, così un
+    singolo picco non decide budget e selezione.
+    """
+    batch = list(X_test)
+    texts = [batch[i % len(batch)] for i in range(LATENCY_SAMPLE)]
+
+    p50, p99, batch_s = [], [], []
+    for r in range(LATENCY_ROUNDS + 1):
+        single = []
+        for t in texts:
+            t0 = time.perf_counter()
+            pipe.predict([t])
+            single.append((time.perf_counter() - t0) * 1000)
+        t0 = time.perf_counter()
+        pipe.predict(batch)
+        elapsed = time.perf_counter() - t0
+        if r == 0:
+            continue  # warm-up
+        p50.append(np.percentile(single, 50))
+        p99.append(np.percentile(single, 99))
+        batch_s.append(elapsed)
+    batch_s = float(np.median(batch_s))
+
+    buf = io.BytesIO()
+    joblib.dump(pipe, buf)
+    size_kb = buf.tell() / 1024
+    buf.seek(0)
+    t0 = time.perf_counter()
+    joblib.load(buf)
+    load_ms = (time.perf_counter() - t0) * 1000
+
+    return {
+        "p50_ms": float(np.median(p50)),
+        "p99_ms": float(np.median(p99)),
+        "throughput": len(batch) / batch_s if batch_s > 0 else float("inf"),
+        "size_kb": size_kb,
+        "load_ms": load_ms,
+    }
+
+
+def pareto_front(results: List[dict]) -> List[dict]:
+    """Candidati non dominati su (F1 macro alto, p99 basso)."""
+    front = []
+    for r in results:
+        dominated = any(
+            o is not r
+            and o["f1_macro"] >= r["f1_macro"] and o["p99_ms"] <= r["p99_ms"]
+            and (o["f1_macro"] > r["f1_macro"] or o["p99_ms"] < r["p99_ms"])
+            for o in results
+        )
+        if not dominated:
+            front.append(r)
+    return front
+
+
+def select_model(results: List[dict], mode: str = "f1", max_p99_ms: Optional[float] = None,
+                 max_size_kb: Optional[float] = None, f1_tolerance: float = SELECT_F1_TOLERANCE) -> dict:
+    """
+    Sceglie il modello tra i candidati che rispettano i budget (p99, dimensione).
+    mode='f1': il migliore per F1 macro.
+    mode='pareto': sulla frontiera F1/p99, il più veloce entro f1_tolerance dal migliore.
+    Se nessun candidato rispetta i budget solleva BudgetError: meglio non salvare
+    nessun modello che salvarne uno fuori SLA.
+    """
+    if mode not in SELECT_MODES:
+        raise ValueError(f"Modalità di selezione non valida: {mode} (attese: {', '.join(SELECT_MODES)})")
+
+    feasible = [
+        r for r in results
+        if (max_p99_ms is None or r["p99_ms"] <= max_p99_ms)
+        and (max_size_kb is None or r["size_kb"] <= max_size_kb)
+    ]
+    if not feasible:
+        costs = "; ".join(f"{r['name']}: p99 {r['p99_ms']:.2f} ms, {r['size_kb']:.0f} KB" for r in results)
+        raise BudgetError(
+            f"Nessun modello rispetta il budget (p99 <= {max_p99_ms} ms, size <= {max_size_kb} KB): {costs}"
+        )
+
+    if mode == "f1":
+        return max(feasible, key=lambda r: r["f1_macro"])
+
+    front = pareto_front(feasible)
+    best_f1 = max(r["f1_macro"] for r in front)
+    return min(
+        (r for r in front if r["f1_macro"] >= best_f1 - f1_tolerance),
+        key=lambda r: r["p99_ms"],
+    )
+
+
+def format_costs(r: dict) -> str:
+    return (
+        f"p50: {r['p50_ms']:.2f} ms | p99: {r['p99_ms']:.2f} ms | "
+        f"Throughput: {r['throughput']:.0f} ticket/s | Size: {r['size_kb']:.0f} KB | Load: {r['load_ms']:.1f} ms"
+    )
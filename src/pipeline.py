@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+STATE_PATH = "reports/pipeline_state.json"
+
+
+@dataclass
+class Stage:
+    name: str
+    module: str
+    args: List[str]
+    inputs: List[str]   # dati + sorgenti: se cambiano, lo stadio va rieseguito
+    outputs: List[str]
+    stdout: Optional[str] = None
+    deps: List[str] = field(default_factory=list)
+
+    @property
+    def cmd(self) -> List[str]:
+        return [sys.executable, "-m", self.module, *self.args]
+
+
+def build_stages(n: int = 350, seed: int = 42, cascade: bool = False, select_mode: str = "f1",
+                 max_p99_ms: Optional[float] = None, max_size_kb: Optional[float] = None) -> Dict[str, Stage]:
+    tickets = "data/tickets.csv"
+    # Solo gli store usati dal training (non l'intera data/features, che cresce con append e dataset vecchi)
+    features = "models/feature_stores.json"
+    models = ["models/category_model.joblib", "models/priority_model.joblib"]
+    # I parametri di selezione sono argomenti del comando, quindi parte della chiave di cache
+    train_args = ["--select", select_mode]
+    if max_p99_ms is not None:
+        train_args += ["--max-p99-ms", str(max_p99_ms)]
+    if max_size_kb is not None:
+        train_args += ["--max-size-kb", str(max_size_kb)]
+    stages = [
+        Stage(
+            name="generate",
+            module="src.generate_dataset",
+            args=["--n", str(n), "--seed", str(seed), "--out", tickets],
+            inputs=["src/generate_dataset.py"],
+            outputs=[tickets],
+        ),
+        Stage(
+            name="train",
+            module="src.train_models",
+            args=train_args,
+            inputs=[tickets, "src/train_models.py", "src/features.py", "src/cascade.py",
+                    "src/feature_store.py", "src/latency.py"],
+            outputs=[*models, "models/category_cascade.joblib", "models/manifest.json",
+                     "reports/metrics_summary.txt", features],
+            stdout="reports/metrics.txt",
+        ),
+        Stage(
+            name="report",
+            module="src.report_figures",
+            args=[],
+            inputs=[tickets, *models, features, "src/report_figures.py", "src/feature_store.py"],
+            outputs=["reports/class_distribution_category.png", "reports/class_distribution_priority.png",
+                     "reports/f1_per_class_category.png", "reports/f1_per_class_priority.png"],
+        ),
+        Stage(
+            name="predict",
+            module="src.predict_batch",
+            args=["--cascade"] if cascade else [],
+            inputs=[tickets, *models, "models/category_cascade.joblib", "src/predict_batch.py",
+                    "src/priority_hybrid.py", "src/cascade.py", "src/features.py"],
+            outputs=["data/predictions.csv"],
+        ),
+    ]
+
+    # Dipendenze ricavate dai file: uno stadio dipende da chi produce i suoi input
+    producers = {out: s.name for s in stages for out in s.outputs}
+    for s in stages:
+        s.deps = sorted({producers[i] for i in s.inputs if i in producers and producers[i] != s.name})
+    return {s.name: s for s in stages}
+
+
+def file_hash(path: str) -> Optional[str]:
+    if not os.path.exists(path):
+        return None
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def stage_key(stage: Stage) -> str:
+    """Hash di comando + contenuto degli input."""
+    h = hashlib.sha256()
+    h.update(json.dumps([stage.module, stage.args, stage.stdout]).encode())
+    for path in stage.inputs:
+        h.update(path.encode())
+        h.update((file_hash(path) or "missing").encode())
+    return h.hexdigest()
+
+
+def load_state(path: str = STATE_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(state: dict, path: str = STATE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+def up_to_date(stage: Stage, key: str, state: dict) -> bool:
+    """Aggiornato se gli input non sono cambiati e gli output sono quelli prodotti l'ultima volta."""
+    prev = state.get(stage.name)
+    if not prev or prev.get("key") != key:
+        return False
+    outputs = prev.get("outputs", {})
+    return all(file_hash(p) is not None and file_hash(p) == outputs.get(p) for p in stage.outputs)
+
+
+def run_stage(stage: Stage) -> float:
+    for path in stage.outputs + ([stage.stdout] if stage.stdout else []):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    t0 = time.perf_counter()
+    if stage.stdout:
+        with open(stage.stdout, "w", encoding="utf-8") as out:
+            proc = subprocess.run(stage.cmd, stdout=out, stderr=subprocess.PIPE, text=True)
+    else:
+        proc = subprocess.run(stage.cmd, capture_output=True, text=True)
+    elapsed = time.perf_counter() - t0
+
+    if proc.returncode != 0:
+        raise RuntimeError(f"Stadio '{stage.name}' fallito (exit {proc.returncode}):\n{proc.stderr}")
+    missing = [p for p in stage.outputs if not os.path.exists(p)]
+    if missing:
+        raise RuntimeError(f"Stadio '{stage.name}' non ha prodotto: {', '.join(missing)}")
+    return elapsed
+
+
+def select(stages: Dict[str, Stage], targets: List[str]) -> List[str]:
+    """Stadi richiesti più le loro dipendenze (transitive)."""
+    todo, seen = list(targets), set()
+    while todo:
+        name = todo.pop()
+        if name not in stages:
+            raise ValueError(f"Stadio sconosciuto: {name} (disponibili: {', '.join(stages)})")
+        if name not in seen:
+            seen.add(name)
+            todo.extend(stages[name].deps)
+    return [s for s in stages if s in seen]
+
+
+def run(stages: Dict[str, Stage], targets: Optional[List[str]] = None, force: Optional[List[str]] = None,
+        jobs: int = 2, dry_run: bool = False) -> dict:
+    """
+    Esegue gli stadi in ordine di dipendenza; quelli indipendenti in parallelo
+    (fino a `jobs`). Ritorna {stadio: 'skip' | 'run' | 'dry-run'} con i tempi nello stato.
+    """
+    names = select(stages, targets or list(stages))
+    force = set(force or [])
+    state = load_state()
+    status: Dict[str, str] = {}
+    pending = set(names)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            ready = [n for n in names if n in pending
+                     and all(d in status or d not in names for d in stages[n].deps)]
+            for name in ready:
+                pending.discard(name)
+                stage = stages[name]
+                key = stage_key(stage)
+                # In dry-run gli input a monte non sono ancora stati rigenerati
+                upstream_dry = any(status.get(d) == "dry-run" for d in stage.deps)
+                if name not in force and not upstream_dry and up_to_date(stage, key, state):
+                    status[name] = "skip"
+                    print(f"[{name}] aggiornato, saltato")
+                elif dry_run:
+                    status[name] = "dry-run"
+                    print(f"[{name}] da eseguire: {' '.join(stage.cmd[1:])}")
+                else:
+                    print(f"[{name}] avvio: {' '.join(stage.cmd[1:])}")
+                    running[pool.submit(run_stage, stage)] = (name, key)
+
+            if not running:
+                if pending and not ready:
+                    raise RuntimeError(f"Dipendenze non risolvibili: {', '.join(sorted(pending))}")
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name, key = running.pop(fut)
+                elapsed = fut.result()
+                status[name] = "run"
+                state[name] = {
+                    "key": key,
+                    "outputs": {p: file_hash(p) for p in stages[name].outputs},
+                    "seconds": round(elapsed, 3),
+                    "finished": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                }
+                save_state(state)
+                print(f"[{name}] completato in {elapsed:.1f}s")
+    return status
+
+
+def main():
+    p = argparse.ArgumentParser(description="Pipeline generate -> train -> report/predict con cache degli artefatti")
+    p.add_argument("targets", nargs="*", help="Stadi da eseguire (default: tutti). Le dipendenze sono incluse.")
+    p.add_argument("--force", nargs="*", default=[], help="Stadi da rieseguire anche se aggiornati")
+    p.add_argument("--jobs", type=int, default=2, help="Stadi indipendenti eseguiti in parallelo")
+    p.add_argument("--dry-run", action="store_true", help="Mostra cosa verrebbe eseguito")
+    p.add_argument("--n", type=int, default=350, help="Numero ticket del dataset sintetico")
+    p.add_argument("--seed", type=int, default=42, help="Seed del dataset (fisso per rendere la cache efficace)")
+    p.add_argument("--cascade", action="store_true", help="predict_batch con cascata fast -> slow (models/category_cascade.joblib)")
+    p.add_argument("--select", choices=("f1", "pareto"), default="f1", help="Selezione modello categoria (train)")
+    p.add_argument("--max-p99-ms", type=float, default=None, help="Budget latenza p99 (train)")
+    p.add_argument("--max-size-kb", type=float, default=None, help="Budget dimensione modello (train)")
+    args = p.parse_args()
+
+    stages = build_stages(n=args.n, seed=args.seed, cascade=args.cascade, select_mode=args.select,
+                          max_p99_ms=args.max_p99_ms, max_size_kb=args.max_size_kb)
+    for name in args.targets + args.force:
+        if name not in stages:
+            p.error(f"stadio sconosciuto: {name} (disponibili: {', '.join(stages)})")
+    t0 = time.perf_counter()
+    status = run(stages, targets=args.targets, force=args.force, jobs=args.jobs, dry_run=args.dry_run)
+
+    state = load_state()
+    print("\nStadio     | Esito   | Ultima durata")
+    for name, st in status.items():
+        secs = state.get(name, {}).get("seconds")
+        print(f"{name:<10} | {st:<7} | {f'{secs:.1f}s' if secs is not None else '-'}")
+    print(f"Totale: {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
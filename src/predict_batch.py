@@ -1,21 +1,33 @@
+import argparse
+
 import joblib
 import pandas as pd
 
 from src.priority_hybrid import predict_priority_hybrid
+from src.cascade import predict_cascade
 
 
-def main(in_csv="data/tickets.csv", out_csv="data/predictions.csv"):
-    df = pd.read_csv(in_csv)
+def predict_frame(df: pd.DataFrame, cat_model, pri_model, cascade=False):
+    """
+    Applica categoria e priorità ibrida a un DataFrame con colonne title/body.
+    cat_model: pipeline categoria oppure CascadeModel se cascade=True.
+    Ritorna: (DataFrame con le predizioni, statistiche cascata o None)
+    """
     X = (df["title"].fillna("") + " " + df["body"].fillna("")).astype(str)
 
-    cat_model = joblib.load("models/category_model.joblib")
-    pri_model = joblib.load("models/priority_model.joblib")
-
     out = df.copy()
-    out["pred_category"] = cat_model.predict(X)
+    stats = None
+    if cascade:
+        preds, probs, stages, stats = predict_cascade(cat_model, X)
+        out["pred_category"] = preds
+        out["prob_category"] = probs
+        out["category_stage"] = stages
+    else:
+        # sklearn non accetta 0 campioni: con input vuoto restano solo le colonne
+        out["pred_category"] = cat_model.predict(X) if len(X) else []
 
-    if hasattr(cat_model, "predict_proba"):
-        out["prob_category"] = cat_model.predict_proba(X).max(axis=1)
+        if hasattr(cat_model, "predict_proba"):
+            out["prob_category"] = cat_model.predict_proba(X).max(axis=1) if len(X) else []
 
     preds = []
     probs = []
@@ -29,10 +41,38 @@ def main(in_csv="data/tickets.csv", out_csv="data/predictions.csv"):
     out["pred_priority"] = preds
     out["prob_priority_ml"] = probs
     out["priority_reason"] = reasons
+    return out, stats
+
+
+def load_models(cascade=False):
+    path = "models/category_cascade.joblib" if cascade else "models/category_model.joblib"
+    return joblib.load(path), joblib.load("models/priority_model.joblib")
+
+
+def main(in_csv="data/tickets.csv", out_csv="data/predictions.csv", cascade=False):
+    df = pd.read_csv(in_csv)
+    cat_model, pri_model = load_models(cascade)
+
+    out, stats = predict_frame(df, cat_model, pri_model, cascade=cascade)
 
     out.to_csv(out_csv, index=False)
     print(f"Creato: {out_csv} ({len(out)} righe)")
 
+    if cascade:
+        # Solo tempi misurati: il confronto col modello singolo è in metrics_summary.txt
+        if cat_model.fast is None:
+            print(f"Cascata disattivata in training: categoria solo con {cat_model.slow_name}")
+        print(
+            f"Cascata {cat_model.fast_name} -> {cat_model.slow_name}: fast {stats['n_fast']} ({stats['share_fast']:.1%}) "
+            f"| slow {stats['n_slow']} | tempo: tfidf {stats['vectorize_s'] * 1000:.1f} ms, "
+            f"fast {stats['fast_s'] * 1000:.1f} ms, slow {stats['slow_s'] * 1000:.1f} ms"
+        )
+
 
 if __name__ == "__main__":
-    main()
+    p = argparse.ArgumentParser()
+    p.add_argument("--in", dest="in_csv", type=str, default="data/tickets.csv")
+    p.add_argument("--out", dest="out_csv", type=str, default="data/predictions.csv")
+    p.add_argument("--cascade", action="store_true", help="Categoria con cascata fast -> slow (models/category_cascade.joblib)")
+    args = p.parse_args()
+    main(args.in_csv, args.out_csv, cascade=args.cascade)
@@ -8,6 +8,9 @@ import matplotlib.pyplot as plt
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report
 
+from src import feature_store
+from src.train_models import build_vectorizer
+
 def save_bar_counts(series: pd.Series, title: str, out_path: str):
     counts = series.value_counts().sort_index()
     ax = counts.plot(kind="bar")
@@ -32,6 +35,22 @@ def save_f1_per_class(y_true, y_pred, title: str, out_path: str):
     plt.savefig(out_path, bbox_inches="tight")
     plt.close()
 
+def predict_test(model, df: pd.DataFrame, X: pd.Series, Xtr: pd.Series, Xte: pd.Series):
+    """
+    Predizioni sul test: se train_models ha già salvato le feature nel feature
+    store (stesso dataset, stesso split) si usa la matrice memory-mapped,
+    altrimenti la pipeline completa sul testo.
+    """
+    ids = feature_store.row_positions(df)
+    path = feature_store.lookup(X, ids, build_vectorizer, fit_ids=df.index.get_indexer(Xtr.index))
+    clf = model.named_steps["clf"]
+    if path is not None:
+        F, row_ids, _ = feature_store.load(path, include_appended=False)
+        if F.shape[1] == clf.n_features_in_:
+            return clf.predict(feature_store.rows(F, row_ids, df.index.get_indexer(Xte.index)))
+    return model.predict(Xte)
+
+
 def main():
     os.makedirs("reports", exist_ok=True)
 
@@ -48,14 +67,14 @@ def main():
     y_cat = df["category"].astype(str)
     Xtr, Xte, ytr, yte = train_test_split(X, y_cat, test_size=0.2, random_state=42, stratify=y_cat)
     cat_model = joblib.load("models/category_model.joblib")
-    ypred_cat = cat_model.predict(Xte)
+    ypred_cat = predict_test(cat_model, df, X, Xtr, Xte)
     save_f1_per_class(yte, ypred_cat, "F1 per classe - Categoria (test 20%)", "reports/f1_per_class_category.png")
 
     # Priorità
     y_pri = df["priority"].astype(str)
     Xtr, Xte, ytr, yte = train_test_split(X, y_pri, test_size=0.2, random_state=42, stratify=y_pri)
     pri_model = joblib.load("models/priority_model.joblib")
-    ypred_pri = pri_model.predict(Xte)
+    ypred_pri = predict_test(pri_model, df, X, Xtr, Xte)
     save_f1_per_class(yte, ypred_pri, "F1 per classe - Priorità (test 20%)", "reports/f1_per_class_priority.png")
 
     print("Creati grafici in reports/: distribuzioni + F1 per classe")
@@ -1,6 +1,11 @@
 from __future__ import annotations
 
+import argparse
+import json
+import math
 import os
+from datetime import datetime
+
 import joblib
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -13,6 +18,12 @@ from sklearn.linear_model import LogisticRegression
 from sklearn.naive_bayes import MultinomialNB
 
 from src.features import basic_clean
+from src.cascade import CascadeModel, build_cascade
+from src import feature_store
+from src.latency import SELECT_MODES, BudgetError, format_costs, profile_model, select_model
+
+
+FEATURE_STORES_PATH = "models/feature_stores.json"
 
 
 def build_vectorizer() -> TfidfVectorizer:
@@ -23,9 +34,26 @@ def build_vectorizer() -> TfidfVectorizer:
     )
 
 
-def eval_model(name: str, pipe: Pipeline, X_train, X_test, y_train, y_test, label_col: str) -> dict:
-    pipe.fit(X_train, y_train)
-    y_pred = pipe.predict(X_test)
+def split_features(df: pd.DataFrame, X: pd.Series, X_train: pd.Series, X_test: pd.Series):
+    """
+    Feature TF-IDF dal feature store (data/features): il vectorizer è addestrato
+    solo sulle righe di training, la matrice copre tutto il dataset.
+    Le righe sono identificate per posizione, la colonna id non è richiesta.
+    Ritorna: (vectorizer addestrato, F_train, F_test, cartella dello store)
+    """
+    pos_train = df.index.get_indexer(X_train.index)
+    pos_test = df.index.get_indexer(X_test.index)
+    F, _, vec, path = feature_store.get_or_build(
+        X, feature_store.row_positions(df), build_vectorizer, fit_ids=pos_train
+    )
+    return vec, F[pos_train], F[pos_test], path
+
+
+def eval_model(name: str, pipe: Pipeline, F_train, F_test, y_train, y_test, label_col: str) -> dict:
+    # Lo step tfidf della pipeline è già addestrato: si addestra solo il classificatore
+    clf = pipe.named_steps["clf"]
+    clf.fit(F_train, y_train)
+    y_pred = clf.predict(F_test)
 
     acc = accuracy_score(y_test, y_pred)
     f1m = f1_score(y_test, y_pred, average="macro")
@@ -44,7 +72,13 @@ def eval_model(name: str, pipe: Pipeline, X_train, X_test, y_train, y_test, labe
     return {"name": name, "pipe": pipe, "accuracy": acc, "f1_macro": f1m}
 
 
-def train_category(df: pd.DataFrame) -> dict:
+def profile(res: dict, X_test) -> dict:
+    res.update(profile_model(res["pipe"], X_test))
+    print(f"Costi inferenza {res['name']}: {format_costs(res)}")
+    return res
+
+
+def train_category(df: pd.DataFrame, mode: str = "f1", max_p99_ms=None, max_size_kb=None) -> dict:
     X = (df["title"].fillna("") + " " + df["body"].fillna("")).astype(str)
     y = df["category"].astype(str)
 
@@ -52,18 +86,27 @@ def train_category(df: pd.DataFrame) -> dict:
         X, y, test_size=0.2, random_state=42, stratify=y
     )
 
-    vec = build_vectorizer()
+    vec, F_train, F_test, store = split_features(df, X, X_train, X_test)
 
     # Modello 1: Logistic Regression
     pipe_lr = Pipeline([("tfidf", vec), ("clf", LogisticRegression(max_iter=2000))])
-    res_lr = eval_model("LogReg", pipe_lr, X_train, X_test, y_train, y_test, "category")
+    res_lr = eval_model("LogReg", pipe_lr, F_train, F_test, y_train, y_test, "category")
 
-    # Modello 2: Multinomial Naive Bayes
-    pipe_nb = Pipeline([("tfidf", build_vectorizer()), ("clf", MultinomialNB())])
-    res_nb = eval_model("NaiveBayes", pipe_nb, X_train, X_test, y_train, y_test, "category")
+    # Modello 2: Multinomial Naive Bayes (stesse feature, nessuna ri-vettorizzazione)
+    pipe_nb = Pipeline([("tfidf", vec), ("clf", MultinomialNB())])
+    res_nb = eval_model("NaiveBayes", pipe_nb, F_train, F_test, y_train, y_test, "category")
+
+    candidates = [profile(res_lr, X_test), profile(res_nb, X_test)]
+    best = select_model(candidates, mode=mode, max_p99_ms=max_p99_ms, max_size_kb=max_size_kb)
+    print(
+        f"\n>>> Miglior modello CATEGORY: {best['name']} (F1 macro={best['f1_macro']:.3f}, "
+        f"p99={best['p99_ms']:.2f} ms, selezione={mode})"
+    )
+    best["candidates"] = candidates
+    best["feature_store"] = store
 
-    best = max([res_lr, res_nb], key=lambda r: r["f1_macro"])
-    print(f"\n>>> Miglior modello CATEGORY: {best['name']} (F1 macro={best['f1_macro']:.3f})")
+    # Cascata: NB piccolo decide i ticket sicuri, gli incerti passano al modello selezionato
+    best["cascade"] = build_cascade(best, X_train, y_train, X_test, y_test)
     return best
 
 
@@ -75,33 +118,114 @@ def train_priority(df: pd.DataFrame) -> dict:
         X, y, test_size=0.2, random_state=42, stratify=y
     )
 
+    vec, F_train, F_test, store = split_features(df, X, X_train, X_test)
+
     pipe = Pipeline([
-        ("tfidf", build_vectorizer()),
+        ("tfidf", vec),
         ("clf", LogisticRegression(max_iter=2000))
     ])
 
-    res = eval_model("LogReg", pipe, X_train, X_test, y_train, y_test, "priority")
-    return res
+    res = eval_model("LogReg", pipe, F_train, F_test, y_train, y_test, "priority")
+    res["feature_store"] = store
+    return profile(res, X_test)
+
+
+def _dump_model(model, path: str):
+    """
+    joblib.dump senza _stop_words_id, cache interna dei TF-IDF che contiene un id()
+    di processo: a parità di training l'artefatto resta identico byte per byte e la
+    pipeline non riesegue gli stadi a valle.
+    """
+    pipes = [model.fast, model.slow] if isinstance(model, CascadeModel) else [model]
+    for pipe in pipes:
+        if pipe is not None:
+            vars(pipe.named_steps["tfidf"]).pop("_stop_words_id", None)
+    joblib.dump(model, path)
+
+
+def _json_safe(v):
+    # inf/NaN (es. soglia cascata 'tutto slow') non sono JSON standard: null
+    if isinstance(v, float) and not math.isfinite(v):
+        return None
+    if isinstance(v, dict):
+        return {k: _json_safe(x) for k, x in v.items()}
+    if isinstance(v, list):
+        return [_json_safe(x) for x in v]
+    return v
+
+
+def _manifest_entry(res: dict) -> dict:
+    return {k: v for k, v in res.items() if k not in ("pipe", "cascade", "candidates")}
+
+
+def write_manifest(best_cat: dict, pri_res: dict, selection: dict, path: str = "models/manifest.json"):
+    cas = best_cat["cascade"]
+    manifest = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "selection": selection,
+        "category": {
+            "model": "models/category_model.joblib",
+            "selected": best_cat["name"],
+            "candidates": [_manifest_entry(r) for r in best_cat["candidates"]],
+        },
+        "priority": {"model": "models/priority_model.joblib", **_manifest_entry(pri_res)},
+        "cascade": {
+            "model": "models/category_cascade.joblib",
+            **{k: v for k, v in cas.items() if k != "cascade"},
+        },
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(_json_safe(manifest), f, indent=2, ensure_ascii=False, allow_nan=False)
 
 
 def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--select", choices=SELECT_MODES, default="f1",
+                   help="f1: miglior F1 macro | pareto: il più veloce entro SELECT_F1_TOLERANCE dal miglior F1")
+    p.add_argument("--max-p99-ms", type=float, default=None, help="Budget latenza singolo ticket (p99, ms)")
+    p.add_argument("--max-size-kb", type=float, default=None, help="Budget dimensione modello serializzato (KB)")
+    args = p.parse_args()
+
     os.makedirs("models", exist_ok=True)
     os.makedirs("reports", exist_ok=True)
 
     df = pd.read_csv("data/tickets.csv")
 
-    best_cat = train_category(df)
+    try:
+        best_cat = train_category(df, mode=args.select, max_p99_ms=args.max_p99_ms, max_size_kb=args.max_size_kb)
+    except BudgetError as e:
+        # Nessun modello salvato: exit code != 0 per chi orchestra il training
+        raise SystemExit(f"Errore selezione modello: {e}")
     pri_res = train_priority(df)
 
     # Salva SOLO il best per category
-    joblib.dump(best_cat["pipe"], "models/category_model.joblib")
-    joblib.dump(pri_res["pipe"], "models/priority_model.joblib")
+    _dump_model(best_cat["pipe"], "models/category_model.joblib")
+    _dump_model(pri_res["pipe"], "models/priority_model.joblib")
+    cas = best_cat["cascade"]
+    _dump_model(cas["cascade"], "models/category_cascade.joblib")
+    write_manifest(best_cat, pri_res, {
+        "mode": args.select, "max_p99_ms": args.max_p99_ms, "max_size_kb": args.max_size_kb,
+    })
+    # Store usati da questo training (li rilegge report_figures): traccia stabile per la pipeline
+    with open(FEATURE_STORES_PATH, "w", encoding="utf-8") as f:
+        json.dump({"category": best_cat["feature_store"], "priority": pri_res["feature_store"]}, f, indent=2)
 
     # Riassunto metriche
     with open("reports/metrics_summary.txt", "w", encoding="utf-8") as f:
         f.write("STT - Sintesi metriche\n\n")
         f.write(f"Categoria - Best: {best_cat['name']} | Acc: {best_cat['accuracy']:.3f} | F1 macro: {best_cat['f1_macro']:.3f}\n")
         f.write(f"Priorità - LogReg | Acc: {pri_res['accuracy']:.3f} | F1 macro: {pri_res['f1_macro']:.3f}\n")
+        f.write(
+            f"Categoria - Cascata {cas['fast']}->{cas['slow']} | Soglia: {cas['threshold']:.2f} "
+            f"| F1 macro: {cas['f1_macro']:.3f} (solo {cas['reference']}: {cas['f1_reference']:.3f}) "
+            f"| Traffico fast: {cas['share_fast']:.1%} "
+            f"| Tempo test misurato: {cas['cascade_s'] * 1000:.2f} ms vs {cas['baseline_s'] * 1000:.2f} ms"
+            + (f" | DISATTIVATA: {cas['disabled_reason']}" if not cas["active"] else "") + "\n"
+        )
+        f.write(f"\nCosti inferenza (test, selezione: {args.select})\n")
+        for r in best_cat["candidates"]:
+            f.write(f"Categoria - {r['name']} | {format_costs(r)}\n")
+        f.write(f"Priorità - LogReg | {format_costs(pri_res)}\n")
 
     print("\nSalvati modelli in /models e grafici in /reports")
     print("Nota: confusion matrix anche per entrambi i modelli categoria (NB e LogReg).")
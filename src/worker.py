@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+from typing import List, Optional
+
+import pandas as pd
+
+from src.explain import top_terms
+from src.predict_batch import load_models, predict_frame
+from src.cascade import STAGE_FAST
+
+BATCH_SIZE = 64
+MAX_WAIT_MS = 50
+
+_EOF = object()
+
+
+def _reader(stream, q: queue.Queue):
+    try:
+        # Anche le righe vuote: ogni riga di input ha la sua riga di output
+        for line in stream:
+            q.put(line)
+    finally:
+        # Anche se la lettura fallisce (es. decodifica), serve non resta bloccato
+        q.put(_EOF)
+
+
+def _next_batch(q: queue.Queue, batch_size: int, max_wait_s: float):
+    """
+    Attende il primo ticket, poi raccoglie fino a batch_size righe o fino allo
+    scadere di max_wait_s. Ritorna: (righe, fine_input)
+    """
+    first = q.get()
+    if first is _EOF:
+        return [], True
+    lines = [first]
+    deadline = time.monotonic() + max_wait_s
+    while len(lines) < batch_size:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            break
+        try:
+            item = q.get(timeout=timeout)
+        except queue.Empty:
+            break
+        if item is _EOF:
+            return lines, True
+        lines.append(item)
+    return lines, False
+
+
+def _text_field(obj: dict, key: str) -> str:
+    v = obj.get(key)
+    if v is None:
+        return ""
+    if isinstance(v, (str, int, float)):
+        return str(v)
+    raise ValueError(f"il campo '{key}' deve essere una stringa")
+
+
+def _parse(line: str) -> dict:
+    if not line.strip():
+        raise ValueError("riga vuota")
+    obj = json.loads(line)
+    if not isinstance(obj, dict):
+        raise ValueError("il ticket deve essere un oggetto JSON")
+    if "text" in obj and "title" not in obj and "body" not in obj:
+        obj = {**obj, "title": obj["text"], "body": ""}
+    return {**obj, "title": _text_field(obj, "title"), "body": _text_field(obj, "body")}
+
+
+def predict_lines(lines: List[str], cat_model, pri_model, cascade=False, k: int = 0) -> List[dict]:
+    """Un risultato per riga, nello stesso ordine; righe non valide -> {'error': ...}."""
+    results: List[Optional[dict]] = [None] * len(lines)
+    tickets, pos = [], []
+    for i, line in enumerate(lines):
+        try:
+            tickets.append(_parse(line))
+            pos.append(i)
+        except ValueError as e:  # json.JSONDecodeError è una ValueError
+            results[i] = {"error": str(e)}
+
+    if tickets:
+        df = pd.DataFrame(
+            [{"title": t["title"], "body": t["body"]} for t in tickets]
+        )
+        out, _ = predict_frame(df, cat_model, pri_model, cascade=cascade)
+        texts = (df["title"] + " " + df["body"]).astype(str).tolist()
+
+        for j, (i, t) in enumerate(zip(pos, tickets)):
+            row = out.iloc[j]
+            res = {}
+            if "id" in t:
+                res["id"] = t["id"]
+            res["category"] = row["pred_category"]
+            res["probability"] = float(row["prob_category"]) if "prob_category" in out else None
+            if cascade:
+                res["category_stage"] = row["category_stage"]
+            res["priority"] = row["pred_priority"]
+            res["prob_priority_ml"] = None if pd.isna(row["prob_priority_ml"]) else float(row["prob_priority_ml"])
+            res["priority_reason"] = row["priority_reason"]
+            if k:
+                if cascade:
+                    pipe = cat_model.fast if row["category_stage"] == STAGE_FAST else cat_model.slow
+                else:
+                    pipe = cat_model
+                _, terms = top_terms(pipe, texts[j], k=k)
+                res["top_terms"] = [[term, float(score)] for term, score in terms]
+            results[i] = res
+    return results
+
+
+def serve(stdin=sys.stdin, stdout=sys.stdout, batch_size: int = BATCH_SIZE,
+          max_wait_ms: int = MAX_WAIT_MS, cascade=False, k: int = 0) -> int:
+    """
+    Worker persistente: modelli caricati una sola volta, ticket NDJSON da stdin,
+    un risultato JSON per riga su stdout (ordine preservato).
+    Ritorna il numero di ticket elaborati.
+    """
+    cat_model, pri_model = load_models(cascade)
+
+    q: queue.Queue = queue.Queue(maxsize=batch_size * 4)
+    threading.Thread(target=_reader, args=(stdin, q), daemon=True).start()
+
+    n = 0
+    done = False
+    while not done:
+        lines, done = _next_batch(q, batch_size, max_wait_ms / 1000)
+        if not lines:
+            break
+        for res in predict_lines(lines, cat_model, pri_model, cascade=cascade, k=k):
+            stdout.write(json.dumps(res, ensure_ascii=False) + "\n")
+        stdout.flush()
+        n += len(lines)
+    return n
+
+
+def main():
+    p = argparse.ArgumentParser(description="Worker NDJSON stdin -> stdout (modelli caricati una volta)")
+    p.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    p.add_argument("--max-wait-ms", type=int, default=MAX_WAIT_MS, help="Attesa massima per riempire un batch")
+    p.add_argument("--cascade", action="store_true", help="Categoria con cascata fast -> slow")
+    p.add_argument("--top-k", type=int, default=0, help="Se > 0 aggiunge le top-k parole influenti (categoria)")
+    args = p.parse_args()
+
+    t0 = time.perf_counter()
+    n = serve(batch_size=args.batch_size, max_wait_ms=args.max_wait_ms, cascade=args.cascade, k=args.top_k)
+    print(f"Worker terminato: {n} ticket in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()